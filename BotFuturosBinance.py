@@ -8,52 +8,204 @@ Bot de Futuros USD para el par SOL/USDT
 - Al abrir una posición, coloca un trailing stop del 1.0% (sin stop loss fijo)
 - Gestiona órdenes conflictivas y registra eventos en un archivo CSV
 - Incluye lógica de reconexión ante errores
+- Recibe velas, mark price y posición por WebSocket en lugar de consultar la API REST
+- Probado con python-binance==1.0.37 (FastClient sobrescribe un método interno de Client)
 """
 
 import os
 import csv
+import atexit
 import time
 import datetime
 import logging
 import math
-import pandas as pd
+import queue
+import threading
+from collections import deque
+import numpy as np
+import binance
+from binance import ThreadedWebsocketManager
 from binance.client import Client
-from binance.exceptions import BinanceAPIException
+from binance.exceptions import BinanceAPIException, BinanceRequestException
+
+try:
+    # orjson es opcional: parsea las respuestas JSON (p. ej. klines) bastante más rápido que json
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    # numba es opcional: sin él, las funciones decoradas se ejecutan como Python normal
+    NUMBA_AVAILABLE = False
+
+    def njit(*args, **kwargs):
+        """Sustituto de numba.njit que devuelve la función sin compilar."""
+        def decorator(func):
+            return func
+        return decorator
+
+try:
+    from scipy.signal import lfilter
+except ImportError:
+    lfilter = None
 
 # Configurar logging básico en consola
 logging.basicConfig(level=logging.INFO)
 
+# Versión de python-binance contra la que se escribió FastClient._handle_response
+PYTHON_BINANCE_VERSION = "1.0.37"
+if binance.__version__ != PYTHON_BINANCE_VERSION:
+    logging.warning("python-binance %s instalado; FastClient se probó con %s",
+                    binance.__version__, PYTHON_BINANCE_VERSION)
+
+# Cantidad de filas del CSV que se acumulan en el buffer antes de forzar la escritura a disco
+LOG_FLUSH_EVERY = 20
+# Intervalo mínimo (en segundos) entre dos registros del evento "No signal"
+NO_SIGNAL_LOG_INTERVAL = 15 * 60
+# Segundos por unidad de los intervalos de velas de Binance (1m, 5m, 1h, 1d, 1w, 1M...)
+INTERVAL_UNIT_SECONDS = {'m': 60, 'h': 3600, 'd': 86400, 'w': 604800, 'M': 2592000}
+# Traducción del código devuelto por update_and_signal a la señal de trading
+SIGNALS = {1: "LONG", -1: "SHORT", 0: None}
+
+
+@njit('f8[:](f8[:], f8)', cache=True, fastmath=True)
+def fast_ewm(x, alpha):
+    """
+    EMA completa de una serie, equivalente a ewm(alpha=alpha, adjust=False).mean():
+    y[0] = x[0]; y[i] = alpha * x[i] + (1 - alpha) * y[i - 1].
+    Se compila con numba al importar el módulo (firma explícita) y se usa para el arranque.
+    """
+    y = np.empty_like(x)
+    y[0] = x[0]
+    for i in range(1, x.shape[0]):
+        y[i] = alpha * x[i] + (1.0 - alpha) * y[i - 1]
+    return y
+
+
+def lfilter_ewm(x, alpha):
+    """
+    Misma EMA que fast_ewm, calculada con scipy.signal.lfilter (b=[alpha], a=[1, alpha - 1]).
+    El estado inicial zi = (1 - alpha) * x[0] hace que y[0] = x[0], igual que ewm(adjust=False).
+    """
+    return lfilter([alpha], [1.0, alpha - 1.0], x, zi=[(1.0 - alpha) * x[0]])[0]
+
+
+@njit('Tuple((f8, f8, i8, f8))(f8, f8, f8, f8, f8, f8)', cache=True)
+def update_and_signal(close, ema_fast, ema_slow, af, as_, prev_diff):
+    """
+    Actualiza en O(1) las EMAs rápida y lenta con el cierre de una vela nueva y detecta el cruce
+    comparando el signo (-1, 0, 1) de la diferencia actual con el de la vela anterior.
+    Devuelve (ema_fast, ema_slow, signal_code, diferencia actual), con signal_code
+    1 para LONG, -1 para SHORT y 0 si no hay señal.
+    Con firma explícita se compila al importar el módulo, no al cerrar la primera vela.
+    """
+    ema_fast += af * (close - ema_fast)
+    ema_slow += as_ * (close - ema_slow)
+    current_diff = ema_fast - ema_slow
+    curr_sign = int(current_diff > 0) - int(current_diff < 0)
+    prev_sign = int(prev_diff > 0) - int(prev_diff < 0)
+    signal_code = 0
+    if curr_sign > 0 and prev_sign <= 0:
+        signal_code = 1
+    elif curr_sign < 0 and prev_sign >= 0:
+        signal_code = -1
+    return ema_fast, ema_slow, signal_code, current_diff
+
+
+# EMA usada para inicializar el estado al arrancar: fast_ewm compilado con numba si está
+# disponible; si no, lfilter de scipy y, en último caso, el bucle de fast_ewm en Python puro
+seed_ewm = fast_ewm if NUMBA_AVAILABLE or lfilter is None else lfilter_ewm
+
+class FastClient(Client):
+    """
+    Cliente de Binance que parsea las respuestas exitosas con orjson (si está instalado).
+    Las respuestas con error se delegan al manejo original de la librería.
+    Se reutiliza la misma instancia (y su sesión HTTP keep-alive) durante toda la ejecución.
+    """
+
+    def _handle_response(self, response):
+        if not (200 <= response.status_code < 300):
+            return super()._handle_response(response)
+        # Igual que python-binance 1.0.37: un cuerpo vacío en una respuesta 2xx es {}
+        if not response.content:
+            return {}
+        try:
+            return json_loads(response.content)
+        except ValueError:
+            raise BinanceRequestException('Invalid Response: %s' % response.text)
+
 class FuturesBot:
     def __init__(self, api_key, api_secret, symbol="ETHUSDT", leverage=10, base_capital_pct=0.95,
                  fast_ema_period=40, slow_ema_period=99, interval="5m"):
         # Guardamos las credenciales para posibles reconexiones
         self.api_key = api_key
         self.api_secret = api_secret
-        self.client = Client(api_key, api_secret)
+        self.client = FastClient(api_key, api_secret)
         self.symbol = symbol              # Par de trading
         self.leverage = leverage          # Apalancamiento configurado
         self.base_capital_pct = base_capital_pct  # Porcentaje del capital a usar (95%)
         self.fast_ema_period = fast_ema_period    # Período para EMA rápida
         self.slow_ema_period = slow_ema_period    # Período para EMA lenta
         self.interval = interval          # Intervalo de velas (5 minutos)
+        self._interval_seconds = int(interval[:-1]) * INTERVAL_UNIT_SECONDS[interval[-1]]
         self.log_file = "trading_log.csv" # Archivo para registrar eventos
+        self._last_no_signal_log_ts = None  # Momento (time.monotonic) del último registro "No signal"
+        # Cierres de las últimas velas cerradas: historial acotado para el arranque de las EMAs
+        self._closes = deque(maxlen=max(slow_ema_period, 200))
+        self._kline_queue = queue.Queue() # (open_time, cierre) recibidos por WebSocket pendientes de procesar
+        self._last_open_time = None       # Apertura (ms) de la última vela aplicada a las EMAs
+        self._last_kline_ts = None        # Momento (time.monotonic) en que llegó la última vela
+        self._mark_price = None           # Último mark price recibido por WebSocket
+        self._position_amt = 0.0          # Posición actual, mantenida por el user-data stream
+        self._usdt_balance = 0.0          # Balance USDT, mantenido por el user-data stream
+        self._other_positions = set()     # Otros símbolos con posición abierta en la cuenta
+        self.twm = None                   # Gestor de WebSockets (se inicia en run)
+        self._reconnect_attempt = 0       # Errores consecutivos, para el backoff exponencial
+        self._open_orders_by_type = {}    # Órdenes abiertas agrupadas por tipo original (origType)
+        self._closed_order_ids = set()    # Órdenes que el stream ya informó cerradas (no volver a cachear)
+        self._orders_stale = False        # True si la posición abrió o cerró y conviene resincronizar
+        self._orders_lock = threading.Lock()  # El user-data stream modifica las órdenes desde otro hilo
+        # Estado incremental de las EMAs: ema = alpha * cierre + (1 - alpha) * ema_anterior
+        self.alpha_fast = 2 / (fast_ema_period + 1)
+        self.alpha_slow = 2 / (slow_ema_period + 1)
+        self.ema_fast = None
+        self.ema_slow = None
+        self.prev_diff = 0.0              # Diferencia EMA rápida - lenta en la vela anterior
         self.setup_csv()                  # Configuramos el archivo CSV de logs
         self.set_leverage()               # Establecemos el apalancamiento en Binance
+        self.load_symbol_filters()        # Cacheamos LOT_SIZE y quantityPrecision del símbolo
 
     def setup_csv(self):
-        """Crea el archivo CSV si no existe y escribe el header."""
-        if not os.path.exists(self.log_file):
-            with open(self.log_file, mode='w', newline='') as file:
-                writer = csv.writer(file)
-                writer.writerow(["timestamp", "event", "details"])
+        """
+        Crea el archivo CSV si no existe y escribe el header.
+        Deja el archivo abierto con un writer reutilizable; se cierra automáticamente al salir.
+        """
+        write_header = not os.path.exists(self.log_file)
+        self._log_fh = open(self.log_file, mode='a', newline='', buffering=8192)
+        self._log_writer = csv.writer(self._log_fh)
+        self._log_pending = 0             # Filas escritas desde el último flush
+        self._log_lock = threading.Lock() # Los callbacks de WebSocket también registran eventos
+        if write_header:
+            self._log_writer.writerow(["timestamp", "event", "details"])
+        atexit.register(self._log_fh.close)
 
     def log(self, event, details=""):
-        """Registra en consola y en el archivo CSV cada evento."""
+        """
+        Registra en consola y en el archivo CSV cada evento.
+        Las filas se acumulan en el buffer del archivo y se escriben a disco cada
+        LOG_FLUSH_EVERY eventos, o de inmediato si el evento es un error.
+        Es seguro llamarlo desde el hilo de los WebSockets.
+        """
         timestamp = datetime.datetime.now().isoformat()
-        log_entry = [timestamp, event, details]
-        with open(self.log_file, mode='a', newline='') as file:
-            writer = csv.writer(file)
-            writer.writerow(log_entry)
+        with self._log_lock:
+            self._log_writer.writerow([timestamp, event, details])
+            self._log_pending += 1
+            if self._log_pending >= LOG_FLUSH_EVERY or "error" in event.lower() or "failed" in event.lower():
+                self._log_fh.flush()
+                self._log_pending = 0
         print(timestamp, event, details)
 
     def set_leverage(self):
@@ -67,100 +219,336 @@ class FuturesBot:
     def get_klines(self, limit=500):
         """
         Obtiene datos históricos de velas (klines) para el símbolo e intervalo configurados.
-        Se convierten a DataFrame para facilitar el cálculo de indicadores.
+        Devuelve la tupla (open_times, closes): tiempos de apertura en ms (índice 0, int64) y
+        precios de cierre (índice 4, float64), que es lo único que usan los indicadores.
         """
         try:
             klines = self.client.futures_klines(symbol=self.symbol, interval=self.interval, limit=limit)
-            df = pd.DataFrame(klines, columns=[
-                'open_time', 'open', 'high', 'low', 'close', 'volume',
-                'close_time', 'quote_asset_volume', 'number_of_trades',
-                'taker_buy_base_asset_volume', 'taker_buy_quote_asset_volume', 'ignore'
-            ])
-            # Conversión de tipos
-            df['open'] = pd.to_numeric(df['open'])
-            df['high'] = pd.to_numeric(df['high'])
-            df['low'] = pd.to_numeric(df['low'])
-            df['close'] = pd.to_numeric(df['close'])
-            df['open_time'] = pd.to_datetime(df['open_time'], unit='ms')
-            return df
+            # Una sola conversión vectorizada por columna
+            klines = np.asarray(klines, dtype=object)
+            return klines[:, 0].astype(np.int64), klines[:, 4].astype(np.float64)
         except Exception as e:
             self.log("Error fetching klines", str(e))
             return None
 
-    def calculate_ema(self, df):
-        """Calcula las EMAs (rápida y lenta) y las añade al DataFrame."""
-        df['ema_fast'] = df['close'].ewm(span=self.fast_ema_period, adjust=False).mean()
-        df['ema_slow'] = df['close'].ewm(span=self.slow_ema_period, adjust=False).mean()
-        return df
+    def seed_closes(self):
+        """
+        Carga por REST el histórico de cierres necesario para las EMAs y reinicia su estado.
+        Se usa al iniciar y cada vez que se detecta un hueco en las velas recibidas por WebSocket.
+        La última vela devuelta sigue abierta, por lo que se descarta: su cierre llegará por WebSocket.
+        """
+        klines = self.get_klines(limit=self._closes.maxlen + 1)
+        if klines is None or len(klines[1]) < 2:
+            return False
+        open_times, closes = klines[0][:-1], klines[1][:-1]
+        self._closes.clear()
+        self._closes.extend(closes.tolist())
+        self.calculate_ema(closes)
+        self._last_open_time = int(open_times[-1])
+        return True
 
-    def determine_signal(self, df):
+    def refresh_position(self):
+        """
+        Consulta por REST la posición abierta del símbolo y qué otros símbolos de la cuenta
+        tienen posición (retienen margen, ver get_available_balance).
+        Solo se usa al iniciar y tras una reconexión; el resto del tiempo las posiciones
+        se actualizan con los eventos ACCOUNT_UPDATE del user-data stream.
         """
-        Determina la señal de trading basándose en el cruce de las EMAs.
+        positions = self.client.futures_position_information()
+        self._position_amt = 0.0
+        self._other_positions = set()
+        for pos in positions:
+            if float(pos['positionAmt']) == 0:
+                continue
+            if pos['symbol'] == self.symbol:
+                self._position_amt = float(pos['positionAmt'])
+            else:
+                self._other_positions.add(pos['symbol'])
+
+    def start_streams(self):
+        """
+        Inicia los WebSockets de Binance Futuros:
+        - <symbol>@kline_<interval> y <symbol>@markPrice en un único stream combinado.
+        - User-data stream para mantener la posición sin consultar la API.
+        """
+        self.twm = ThreadedWebsocketManager(api_key=self.api_key, api_secret=self.api_secret)
+        self.twm.start()
+        stream = self.symbol.lower()
+        self.twm.start_futures_multiplex_socket(
+            callback=self.handle_market_message,
+            streams=[f"{stream}@kline_{self.interval}", f"{stream}@markPrice"]
+        )
+        self.twm.start_futures_user_socket(callback=self.handle_user_message)
+        self.log("Streams started", f"WebSockets de velas, mark price y usuario iniciados para {self.symbol}")
+
+    def restart_streams(self):
+        """
+        Reinicia los WebSockets y recarga el histórico de velas (reinicia las EMAs).
+        Se usa cuando el stream deja de entregar velas y tras una reconexión.
+        """
+        self.stop_streams()
+        self.start_streams()
+        if not self.seed_closes():
+            raise RuntimeError("No se pudo recargar el histórico de velas")
+
+    def resync_state(self):
+        """
+        Reinicia los WebSockets, recarga el histórico de velas y vuelve a sincronizar por REST
+        la posición, el balance y las órdenes abiertas: los eventos del user-data stream
+        enviados mientras el socket estaba caído o reiniciándose se pierden.
+        """
+        self.restart_streams()
+        self.refresh_position()
+        self.refresh_balance()
+        self._refresh_open_orders()
+
+    def stop_streams(self):
+        """Detiene los WebSockets si están activos."""
+        if self.twm is not None:
+            self.twm.stop()
+            self.twm = None
+
+    def handle_market_message(self, msg):
+        """
+        Callback del stream combinado de mercado (se ejecuta en el hilo del WebSocket).
+        Solo las velas cerradas (k['x'] == True) se encolan para el bucle principal, junto con
+        su tiempo de apertura para descartar duplicados y detectar velas perdidas.
+        """
+        if msg.get('e') == 'error':
+            self.log("Market stream error", msg.get('m', ''))
+            return
+        data = msg.get('data', msg)
+        event = data.get('e')
+        if event == 'kline':
+            kline = data['k']
+            if kline['x']:
+                self._kline_queue.put((kline['t'], float(kline['c'])))
+        elif event == 'markPriceUpdate':
+            self._mark_price = float(data['p'])
+
+    def handle_user_message(self, msg):
+        """
+        Callback del user-data stream (se ejecuta en el hilo del WebSocket).
+        Mantiene en memoria la posición del símbolo y el balance USDT a partir de los
+        eventos ACCOUNT_UPDATE. La librería renueva el listen key del stream automáticamente.
+        """
+        if msg.get('e') == 'error':
+            self.log("User stream error", msg.get('m', ''))
+            return
+        if msg.get('e') == 'ACCOUNT_UPDATE':
+            for pos in msg['a'].get('P', []):
+                if pos['s'] == self.symbol:
+                    position_amt = float(pos['pa'])
+                    if (position_amt == 0) != (self._position_amt == 0):
+                        # La posición se abrió o quedó plana: resincronizar órdenes abiertas
+                        self._orders_stale = True
+                    self._position_amt = position_amt
+                elif float(pos['pa']) != 0:
+                    self._other_positions.add(pos['s'])
+                else:
+                    self._other_positions.discard(pos['s'])
+            for balance in msg['a'].get('B', []):
+                if balance['a'] == 'USDT':
+                    # Cross wallet balance: solo se abren posiciones sin otra abierta en el
+                    # símbolo, por lo que coincide con el balance disponible si no hay margen
+                    # retenido por otros símbolos
+                    self._usdt_balance = float(balance['cw'])
+        elif msg.get('e') == 'ORDER_TRADE_UPDATE':
+            order = msg['o']
+            if order['s'] != self.symbol:
+                return
+            if order['X'] in ('NEW', 'PARTIALLY_FILLED'):
+                self._cache_order({'orderId': order['i'], 'type': order['o'],
+                                   'origType': order['ot'], 'status': order['X']})
+            else:
+                # FILLED, CANCELED, EXPIRED, ...: la orden ya no está abierta
+                with self._orders_lock:
+                    self._closed_order_ids.add(order['i'])
+                self._forget_order(order['ot'], order['i'])
+
+    def _refresh_open_orders(self):
+        """
+        Consulta por REST las órdenes abiertas del símbolo y las agrupa por tipo original.
+        Se usa al iniciar, tras una reconexión y cuando la posición se abre o queda plana;
+        el resto del tiempo el caché se mantiene con los eventos ORDER_TRADE_UPDATE del user-data stream.
+        Las órdenes que el stream informe cerradas mientras dura la consulta se quitan de la
+        foto REST, para no volver a cachear una orden ya muerta.
+        """
+        self._orders_stale = False
+        with self._orders_lock:
+            self._closed_order_ids.clear()
+        open_orders = self.client.futures_get_open_orders(symbol=self.symbol)
+        with self._orders_lock:
+            open_orders_by_type = {}
+            for o in open_orders:
+                if o['orderId'] in self._closed_order_ids:
+                    continue
+                open_orders_by_type.setdefault(o.get('origType', o['type']), []).append(o)
+            self._open_orders_by_type = open_orders_by_type
+
+    def _cache_order(self, order):
+        """
+        Agrega (o reemplaza, si ya estaba) una orden abierta en el caché.
+        Se ignora si el stream ya la informó cerrada: la respuesta REST de una orden puede
+        llegar después de su FILLED/CANCELED/EXPIRED.
+        """
+        order_type = order.get('origType', order['type'])
+        with self._orders_lock:
+            if order['orderId'] in self._closed_order_ids:
+                return
+            orders = [o for o in self._open_orders_by_type.get(order_type, []) if o['orderId'] != order['orderId']]
+            orders.append(order)
+            self._open_orders_by_type[order_type] = orders
+
+    def _forget_order(self, order_type, order_id):
+        """Quita una orden del caché de órdenes abiertas."""
+        with self._orders_lock:
+            orders = self._open_orders_by_type.get(order_type, [])
+            self._open_orders_by_type[order_type] = [o for o in orders if o['orderId'] != order_id]
+
+    def _get_open_order(self, order_type):
+        """Devuelve una orden abierta del tipo indicado según el caché, o None si no hay."""
+        with self._orders_lock:
+            orders = self._open_orders_by_type.get(order_type)
+            return orders[-1] if orders else None
+
+    def wait_for_klines(self, timeout):
+        """
+        Bloquea hasta que el WebSocket entregue el cierre de una vela (o venza el timeout),
+        aplica a las EMAs todos los cierres pendientes y devuelve (hubo_velas, señal).
+        hubo_velas es False solo si venció el timeout sin recibir nada del stream.
+        - Las velas ya aplicadas (apertura <= la última) se descartan.
+        - Si falta alguna vela entre la última aplicada y la recibida, se recarga el histórico
+          por REST con seed_closes en lugar de aplicar el cierre sobre unas EMAs desfasadas.
+        """
+        try:
+            item = self._kline_queue.get(timeout=timeout)
+        except queue.Empty:
+            return False, None
+        new_candle = True
+        signal = None
+        interval_ms = self._interval_seconds * 1000
+        while True:
+            open_time, close = item
+            if open_time > self._last_open_time:
+                if open_time != self._last_open_time + interval_ms:
+                    self.log("Kline gap", f"Se esperaba la vela {self._last_open_time + interval_ms} y llegó {open_time}; recargando histórico")
+                    if not self.seed_closes():
+                        raise RuntimeError("No se pudo recargar el histórico de velas")
+                    if signal is not None:
+                        self.log("Signal discarded", f"Señal {signal} descartada al recargar el histórico")
+                    signal = None
+                if open_time > self._last_open_time:
+                    self._closes.append(close)
+                    self._last_open_time = open_time
+                    candle_signal = self.determine_signal(close)
+                    # Se conserva la última señal no nula de las velas pendientes
+                    if candle_signal is not None:
+                        if signal is not None:
+                            self.log("Signal discarded", f"Señal {signal} reemplazada por {candle_signal} de una vela posterior")
+                        signal = candle_signal
+            try:
+                item = self._kline_queue.get_nowait()
+            except queue.Empty:
+                return new_candle, signal
+
+    def calculate_ema(self, closes):
+        """
+        Inicializa el estado de las EMAs (rápida y lenta) a partir del array numpy de cierres.
+        Equivale a ewm(span=N, adjust=False); a partir de aquí se actualizan con determine_signal.
+        """
+        closes = np.ascontiguousarray(closes, dtype=np.float64)
+        self.ema_fast = float(seed_ewm(closes, self.alpha_fast)[-1])
+        self.ema_slow = float(seed_ewm(closes, self.alpha_slow)[-1])
+        self.prev_diff = self.ema_fast - self.ema_slow
+
+    def determine_signal(self, close):
+        """
+        Actualiza las EMAs con el cierre de una vela nueva y determina la señal de trading
+        basándose en el cruce de las EMAs (ver update_and_signal).
         - Si la EMA rápida cruza de abajo hacia arriba la lenta: señal LONG.
         - Si la EMA rápida cruza de arriba hacia abajo la lenta: señal SHORT.
         """
-        if len(df) < 2:
-            return None
-        last_row = df.iloc[-1]
-        prev_row = df.iloc[-2]
-        prev_diff = prev_row['ema_fast'] - prev_row['ema_slow']
-        current_diff = last_row['ema_fast'] - last_row['ema_slow']
-        if prev_diff <= 0 and current_diff > 0:
-            return "LONG"
-        elif prev_diff >= 0 and current_diff < 0:
-            return "SHORT"
-        else:
-            return None
+        self.ema_fast, self.ema_slow, signal_code, self.prev_diff = update_and_signal(
+            float(close), self.ema_fast, self.ema_slow, self.alpha_fast, self.alpha_slow, self.prev_diff
+        )
+        return SIGNALS[signal_code]
 
-    def get_available_balance(self):
-        """Obtiene el balance disponible en USDT para operar en Futuros."""
+    def refresh_balance(self):
+        """
+        Consulta por REST el balance disponible en USDT para operar en Futuros.
+        Solo se usa al iniciar y tras una reconexión; luego lo actualiza el user-data stream.
+        """
         try:
             balance_data = self.client.futures_account_balance()
+            self._usdt_balance = 0.0
             for asset in balance_data:
                 if asset['asset'] == 'USDT':
-                    return float(asset['availableBalance'])
-            return 0.0
+                    self._usdt_balance = float(asset['availableBalance'])
+                    break
         except Exception as e:
             self.log("Error fetching balance", str(e))
-            return 0.0
 
-    def round_quantity(self, quantity):
+    def get_available_balance(self):
         """
-        Redondea la cantidad de acuerdo al filtro LOT_SIZE y a quantityPrecision (si está disponible).
-        Se utiliza math.floor para redondear hacia abajo y cumplir con el step size.
-        Para SOLUSDT se fuerza una precisión de 3 decimales si no se obtiene otra.
+        Devuelve el balance disponible en USDT, mantenido en memoria.
+        Si hay posiciones abiertas en otros símbolos, el cross wallet balance del stream incluye
+        margen ya comprometido, así que se consulta availableBalance por REST.
+        """
+        if self._other_positions:
+            self.refresh_balance()
+        return self._usdt_balance
+
+    def load_symbol_filters(self):
+        """
+        Consulta una sola vez la información del símbolo y guarda el filtro LOT_SIZE
+        y quantityPrecision (si está disponible), para que round_quantity no llame a la API.
+        Para SOLUSDT se fuerza una precisión de 2 decimales si no se obtiene otra.
+        Precalcula además el inverso del step size y la precisión final de redondeo.
+        Se vuelve a cargar tras una reconexión.
         """
+        self._step_size = None
+        self._inv_step = None
+        self._quantity_precision = None
+        self._precision = 3               # Sin información del símbolo se redondea a 3 decimales
         try:
             symbol_info = self.client.get_symbol_info(self.symbol)
             # Obtener precision del símbolo, si está disponible
-            quantity_precision = None
             if "quantityPrecision" in symbol_info and symbol_info["quantityPrecision"] is not None:
-                quantity_precision = int(symbol_info["quantityPrecision"])
-            # Si es SOLUSDT y no se obtuvo precision, forzamos 3 decimales
-            if self.symbol == "SOLUSDT" and quantity_precision is None:
-                quantity_precision = 2
-            step_size = None
+                self._quantity_precision = int(symbol_info["quantityPrecision"])
+            # Si es SOLUSDT y no se obtuvo precision, forzamos 2 decimales
+            if self.symbol == "SOLUSDT" and self._quantity_precision is None:
+                self._quantity_precision = 2
             for f in symbol_info['filters']:
                 if f['filterType'] == 'LOT_SIZE':
-                    step_size = float(f['stepSize'])
+                    self._step_size = float(f['stepSize'])
                     break
-            if step_size is None:
-                rounded = round(quantity, quantity_precision if quantity_precision is not None else 3)
-                self.log("round_quantity", f"Step size no encontrado; usando {rounded}")
-                return rounded
-
-            # Redondea hacia abajo según el step_size
-            rounded_quantity = math.floor(quantity / step_size) * step_size
-            if quantity_precision is not None:
-                final_quantity = round(rounded_quantity, quantity_precision)
-            else:
-                precision = int(round(-math.log(step_size, 10), 0))
-                final_quantity = round(rounded_quantity, precision)
-            self.log("round_quantity", f"quantity: {quantity}, step_size: {step_size}, quantity_precision: {quantity_precision}, final_quantity: {final_quantity}")
-            return final_quantity
+            if self._quantity_precision is not None:
+                self._precision = self._quantity_precision
+            elif self._step_size is not None:
+                self._precision = int(round(-math.log10(self._step_size), 0))
+            if self._step_size is not None:
+                self._inv_step = 1.0 / self._step_size
+            self.log("Symbol filters loaded", f"step_size: {self._step_size}, quantity_precision: {self._quantity_precision}")
         except Exception as e:
-            self.log("Error rounding quantity", str(e))
-            return round(quantity, 3)
+            self.log("Error loading symbol filters", str(e))
+
+    def round_quantity(self, quantity):
+        """
+        Redondea la cantidad de acuerdo al filtro LOT_SIZE y a quantityPrecision (si está disponible),
+        usando los valores cacheados por load_symbol_filters.
+        Se utiliza math.floor para redondear hacia abajo y cumplir con el step size.
+        Si no se pudo obtener la información del símbolo se redondea a 3 decimales.
+        """
+        if self._inv_step is None:
+            rounded = round(quantity, self._precision)
+            self.log("round_quantity", f"Step size no encontrado; usando {rounded}")
+            return rounded
+
+        # Redondea hacia abajo según el step_size
+        final_quantity = round(math.floor(quantity * self._inv_step) / self._inv_step, self._precision)
+        self.log("round_quantity", f"quantity: {quantity}, step_size: {self._step_size}, quantity_precision: {self._quantity_precision}, final_quantity: {final_quantity}")
+        return final_quantity
 
     def calculate_order_quantity(self, entry_price):
         """
@@ -178,6 +566,8 @@ class FuturesBot:
         Coloca una orden de mercado para abrir la posición:
         - LONG: compra (SIDE_BUY)
         - SHORT: venta (SIDE_SELL)
+        Devuelve la tupla (orden, cantidad), con orden None si falló, para reutilizar la cantidad
+        en el trailing stop sin volver a calcularla.
         """
         quantity = self.calculate_order_quantity(entry_price)
         side = Client.SIDE_BUY if signal == "LONG" else Client.SIDE_SELL
@@ -190,10 +580,10 @@ class FuturesBot:
                 reduceOnly=False
             )
             self.log("Order placed", f"Señal: {signal}, Cantidad: {quantity}, Precio de entrada: {entry_price}")
-            return order
+            return order, quantity
         except BinanceAPIException as e:
             self.log("Error placing order", str(e))
-            return None
+            return None, quantity
 
     def place_trailing_stop(self, signal, quantity):
         """
@@ -213,6 +603,7 @@ class FuturesBot:
                 timeInForce='GTC',
                 reduceOnly=True
             )
+            self._cache_order(order)
             self.log("Trailing stop placed", f"Callback Rate: 1.00%, Cantidad: {quantity}")
             return order
         except BinanceAPIException as e:
@@ -229,6 +620,7 @@ class FuturesBot:
                     timeInForce='GTC',
                     reduceOnly=True
                 )
+                self._cache_order(order)
                 self.log("Trailing stop placed on retry", f"Callback Rate: 1.00%, Cantidad: {quantity}")
                 return order
             except BinanceAPIException as e2:
@@ -237,13 +629,11 @@ class FuturesBot:
 
     def check_and_place_trailing_stop(self, signal, quantity):
         """
-        Verifica si ya existe una orden TRAILING_STOP_MARKET para el símbolo.
-        Si no existe, intenta colocarla.
+        Verifica en el caché de órdenes abiertas si ya existe una orden TRAILING_STOP_MARKET
+        para el símbolo. Si no existe, intenta colocarla.
         """
         try:
-            open_orders = self.client.futures_get_open_orders(symbol=self.symbol)
-            has_trailing = any(order['type'] == 'TRAILING_STOP_MARKET' for order in open_orders)
-            if has_trailing:
+            if self._get_open_order('TRAILING_STOP_MARKET') is not None:
                 self.log("Trailing stop check", "Ya existe una orden de trailing stop activa.")
             else:
                 self.log("Trailing stop check", "No se encontró trailing stop. Colocando uno.")
@@ -254,86 +644,123 @@ class FuturesBot:
 
     def manage_stop_orders(self, signal):
         """
-        Verifica si existen órdenes de stop conflictivas (STOP_MARKET y TRAILING_STOP_MARKET)
-        y cancela la que no corresponda para evitar conflictos.
+        Verifica en el caché de órdenes abiertas si existen órdenes de stop conflictivas
+        (STOP_MARKET y TRAILING_STOP_MARKET) y cancela la que no corresponda para evitar conflictos.
         """
         try:
-            open_orders = self.client.futures_get_open_orders(symbol=self.symbol)
-            stop_market_order = None
-            trailing_stop_order = None
-            for order in open_orders:
-                if order['type'] == 'STOP_MARKET':
-                    stop_market_order = order
-                if order['type'] == 'TRAILING_STOP_MARKET':
-                    trailing_stop_order = order
+            stop_market_order = self._get_open_order('STOP_MARKET')
+            trailing_stop_order = self._get_open_order('TRAILING_STOP_MARKET')
             # Si existen ambos, se cancela la orden STOP_MARKET
             if stop_market_order and trailing_stop_order:
                 self.client.futures_cancel_order(symbol=self.symbol, orderId=stop_market_order['orderId'])
+                self._forget_order('STOP_MARKET', stop_market_order['orderId'])
                 self.log("Canceled stop loss order", "Se canceló la orden STOP_MARKET debido a TRAILING_STOP_MARKET activa")
         except BinanceAPIException as e:
             self.log("Error managing stop orders", str(e))
 
     def reconnect(self):
         """
-        Intenta reestablecer la conexión re-inicializando el cliente de Binance.
+        Intenta reestablecer la conexión con Binance.
+        Primero verifica con un ping si el cliente actual sigue respondiendo (a menudo solo
+        falló una petición); solo si no responde se re-inicializa el cliente.
+        En ambos casos se reinician los WebSockets (un socket caído no se recupera solo), se
+        recarga el histórico de velas y se vuelve a sincronizar el estado en memoria
+        (posición, balance y órdenes).
         Se utiliza en caso de errores críticos o problemas de conectividad.
         """
-        self.log("Attempting reconnection", "Reinicializando el cliente de Binance")
+        self.log("Attempting reconnection", f"Intento {self._reconnect_attempt + 1}")
         try:
-            self.client = Client(self.api_key, self.api_secret)
-            self.set_leverage()
-            self.log("Reconnection successful", "Cliente reinicializado exitosamente")
+            try:
+                self.client.futures_ping()
+                self.log("Client alive", "El cliente responde; se reutiliza la conexión existente")
+            except Exception:
+                self.log("Client not responding", "Reinicializando el cliente de Binance")
+                self.client = FastClient(self.api_key, self.api_secret)
+                self.set_leverage()
+                self.load_symbol_filters()
+            self.resync_state()
+            self.log("Reconnection successful", "Conexión y estado restablecidos exitosamente")
         except Exception as e:
             self.log("Reconnection failed", str(e))
 
     def run(self):
         """
         Bucle principal del bot:
-        - Obtiene los datos de velas y calcula indicadores (EMAs).
-        - Verifica continuamente si existe una posición abierta.
-          * Si existe, verifica si tiene trailing stop y, de no tenerlo, lo coloca.
+        - Carga el histórico de velas una sola vez y luego recibe cada vela cerrada por WebSocket.
+        - Cada iteración se dispara al cerrarse una vela: recalcula los indicadores (EMAs) en ese momento.
+        - Verifica si existe una posición abierta (mantenida por el user-data stream).
+          * Si existe, verifica si tiene trailing stop y, de no tenerlo, lo coloca. Mientras la
+            posición no tenga trailing stop se revisa como máximo cada minuto, sin esperar la vela.
         - Si no hay posición abierta, verifica si se genera una señal para abrir una posición,
           y en caso afirmativo, abre la posición y coloca el trailing stop.
         - Registra cada acción y, en caso de error, intenta reconectar.
-        - El bucle se ejecuta cada 10 segundos, y tras un error se espera 60 segundos.
+        - Si no llega ninguna vela en más de un intervalo se reinician los streams, se recarga el
+          histórico y se revisa igualmente la posición.
+        - Tras un error se espera con backoff exponencial (1, 2, 4... hasta 60 segundos).
         """
-        while True:
-            try:
-                df = self.get_klines(limit=100)
-                if df is None:
-                    time.sleep(60)
-                    continue
-                df = self.calculate_ema(df)
-                signal = self.determine_signal(df)
-                
-                # Verificamos si ya hay posición abierta
-                positions = self.client.futures_position_information(symbol=self.symbol)
-                open_positions = [pos for pos in positions if pos['symbol'] == self.symbol and float(pos['positionAmt']) != 0]
-                if open_positions:
-                    self.log("Position check", "Posición abierta detectada.")
-                    # Tomar la cantidad absoluta de la posición abierta
-                    pos_qty = abs(float(open_positions[0]['positionAmt']))
-                    pos_qty = self.round_quantity(pos_qty)
-                    # Si no se genera una nueva señal, inferimos el lado basado en la posición
-                    if signal is None:
-                        signal = "LONG" if float(open_positions[0]['positionAmt']) > 0 else "SHORT"
-                    self.check_and_place_trailing_stop(signal, pos_qty)
-                else:
-                    # Si no hay posición abierta, verificamos la señal para abrir una posición.
-                    if signal:
-                        entry_price = float(df.iloc[-1]['close'])
-                        order = self.place_order(signal, entry_price)
-                        if order is not None:
-                            quantity = self.calculate_order_quantity(entry_price)
-                            self.place_trailing_stop(signal, quantity)
-                            self.manage_stop_orders(signal)
+        try:
+            # Sincronización inicial: resync_state inicia los streams antes de cargar el histórico
+            # para no perder una vela que cierre entre medio (wait_for_klines descarta las que ya
+            # estén en el histórico). Ante un error se reintenta con el mismo backoff del bucle.
+            while True:
+                try:
+                    self.resync_state()
+                    break
+                except Exception as e:
+                    self.log("Error during startup", str(e))
+                    time.sleep(min(60, 2 ** self._reconnect_attempt))
+                    self._reconnect_attempt += 1
+            self._reconnect_attempt = 0
+            self._last_kline_ts = time.monotonic()
+            stall_timeout = self._interval_seconds + 60
+            while True:
+                try:
+                    # Con una posición sin trailing stop no se espera a la próxima vela para reintentar
+                    unprotected = (self._position_amt != 0
+                                   and self._get_open_order('TRAILING_STOP_MARKET') is None)
+                    timeout = min(self._interval_seconds, 60) if unprotected else stall_timeout
+                    new_candle, signal = self.wait_for_klines(timeout=timeout)
+                    if new_candle:
+                        self._last_kline_ts = time.monotonic()
+                    elif time.monotonic() - self._last_kline_ts >= stall_timeout:
+                        self.log("Kline stream timeout", f"Sin velas cerradas en los últimos {stall_timeout} segundos; reiniciando streams")
+                        self.resync_state()
+                        self._last_kline_ts = time.monotonic()
+
+                    if self._orders_stale:
+                        self._refresh_open_orders()
+
+                    # Verificamos si ya hay posición abierta (estado en memoria)
+                    position_amt = self._position_amt
+                    if position_amt != 0:
+                        self.log("Position check", "Posición abierta detectada.")
+                        # Tomar la cantidad absoluta de la posición abierta
+                        pos_qty = self.round_quantity(abs(position_amt))
+                        # Si no se genera una nueva señal, inferimos el lado basado en la posición
+                        if signal is None:
+                            signal = "LONG" if position_amt > 0 else "SHORT"
+                        self.check_and_place_trailing_stop(signal, pos_qty)
                     else:
-                        self.log("No signal", "Sin señal de trading en este momento")
-            except Exception as e:
-                self.log("Error in main loop", str(e))
-                self.reconnect()
-                time.sleep(60)
-            time.sleep(60)
+                        # Si no hay posición abierta, verificamos la señal para abrir una posición.
+                        if signal:
+                            entry_price = self._mark_price or self._closes[-1]
+                            order, quantity = self.place_order(signal, entry_price)
+                            if order is not None:
+                                self.place_trailing_stop(signal, quantity)
+                                self.manage_stop_orders(signal)
+                        elif (self._last_no_signal_log_ts is None
+                              or time.monotonic() - self._last_no_signal_log_ts >= NO_SIGNAL_LOG_INTERVAL):
+                            # Se registra como máximo una vez cada NO_SIGNAL_LOG_INTERVAL segundos
+                            self.log("No signal", "Sin señal de trading en este momento")
+                            self._last_no_signal_log_ts = time.monotonic()
+                    self._reconnect_attempt = 0
+                except Exception as e:
+                    self.log("Error in main loop", str(e))
+                    self.reconnect()
+                    time.sleep(min(60, 2 ** self._reconnect_attempt))
+                    self._reconnect_attempt += 1
+        finally:
+            self.stop_streams()
 
 if __name__ == "__main__":
     # REEMPLAZA 'TU_API_KEY' y 'TU_API_SECRET' con tus credenciales de Binance